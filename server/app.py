@@ -15,7 +15,6 @@ from flask_login import (LoginManager, UserMixin, login_user,
 from flask_socketio import SocketIO, emit
 
 import plc_agent as plc
-import comments_search as hs
 
 # ──────────────────── 設定 ────────────────────
 load_dotenv()
@@ -49,10 +48,8 @@ def create_app():
     program_lock = threading.Lock()
 
     # ───── 事前ロード (環境変数で複数指定可) ─────
-    comment_path = os.getenv("COMMENT_CSV")
-    if comment_path and os.path.exists(comment_path):
-        with open(comment_path, "rb") as f:
-            hs.load_comments(plc.decode_bytes(f.read()))
+    # (run_analysis と同じ変更検知付きローダ経由 → 初回質問で再パースしない)
+    plc.load_comment_csv(os.getenv("COMMENT_CSV"))
 
     program_paths = (os.getenv("PROGRAM_CSVS") or "").split(os.pathsep)
     for path in program_paths:
@@ -61,6 +58,7 @@ def create_app():
                 plc.PROGRAMS[os.path.basename(path)] = plc.load_program(
                     plc.decode_bytes(f.read())
                 )
+            plc.PROGRAMS_VERSION += 1
 
     # ────────── WebSocket ──────────
     @socketio.on("chat")
@@ -108,8 +106,9 @@ def create_app():
         if not file:
             return jsonify({"result": "ng", "error": "no file"}), 400
 
-        hs.load_comments(plc.decode_bytes(file.stream.read()))
-        return jsonify({"result": "ok", "count": len(hs.COMMENTS)})
+        # アップロードしたコメントは以後 COMMENT_CSV より優先される
+        count = plc.load_comment_upload(file.stream.read())
+        return jsonify({"result": "ok", "count": count})
 
     @app.post("/api/programs")
     @login_required
@@ -120,11 +119,16 @@ def create_app():
 
         added = 0
         with program_lock:
-            for f in files:
-                plc.PROGRAMS[f.filename] = plc.load_program(
-                    plc.decode_bytes(f.stream.read())
-                )
-                added += 1
+            try:
+                for f in files:
+                    plc.PROGRAMS[f.filename] = plc.load_program(
+                        plc.decode_bytes(f.stream.read())
+                    )
+                    added += 1
+            finally:
+                # 途中のファイルで失敗しても、差し替え済みの分があれば検索キャッシュを無効化
+                if added:
+                    plc.PROGRAMS_VERSION += 1
 
         return jsonify({"result": "ok", "count": added})
 
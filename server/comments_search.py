@@ -15,23 +15,11 @@ import csv
 import io
 import typing as t
 
+from file_io import decode_bytes, detect_dialect
+
 # ──────────────────── グローバル ────────────────────
 COMMENTS: dict[str, str] = {}
 
-# ──────────────────── 内部ユーティリティ ────────────────────
-def _decode_bytes(data: bytes) -> io.StringIO:
-    """
-    受け取ったバイト列をマルチエンコーディングでデコード。
-
-    優先順: UTF-8-SIG → UTF-16 → Shift-JIS → CP932 → UTF-8 (replace)
-    """
-    for enc in ("utf-8-sig", "utf-16", "shift_jis", "cp932"):
-        try:
-            return io.StringIO(data.decode(enc))
-        except UnicodeDecodeError:
-            continue
-    return io.StringIO(data.decode("utf-8", errors="replace"))
-
 # ──────────────────── 公開 API ────────────────────
 def load_comments(stream_or_bytes: io.TextIOBase | bytes) -> None:
     """
@@ -44,22 +32,18 @@ def load_comments(stream_or_bytes: io.TextIOBase | bytes) -> None:
     """
     # ストリーム化 ----------------------------------------------------------
     if isinstance(stream_or_bytes, bytes):
-        stream = _decode_bytes(stream_or_bytes)
+        stream = decode_bytes(stream_or_bytes)
     else:
         stream = stream_or_bytes
 
     COMMENTS.clear()
 
     # CSV Dialect 判定 ------------------------------------------------------
-    sample = stream.read(1024)
+    # 判定は file_io.detect_dialect と共通 (タイトル行・コメント本文は数えない)
+    sample = stream.read(512)
     stream.seek(0)
 
-    try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=",\t")
-    except csv.Error:
-        dialect = csv.excel_tab
-
-    reader = csv.reader(stream, dialect)
+    reader = csv.reader(stream, detect_dialect(sample))
 
     # CSV パース ------------------------------------------------------------
     for row in reader:
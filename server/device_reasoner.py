@@ -12,11 +12,11 @@
 from __future__ import annotations
 
 import os
-import json
-import re
 import textwrap
+from itertools import chain
 import httpx
 import openai
+import orjson
 from dotenv import load_dotenv
 from agents import function_tool as tool
 import comments_search as hs
@@ -25,14 +25,14 @@ import plc_agent
 # ──────────────────── OpenAI 初期化 ────────────────────
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY", "")
-client = openai.OpenAI(
+# 常駐ループ上の tool から呼ぶため async クライアント (ループを塞がない)
+client = openai.AsyncOpenAI(
     api_key=openai.api_key,
     timeout=httpx.Timeout(120.0, read=None),
 )
 
 # ──────────────────── 定数 ────────────────────
 ALLOWED_DEVS: set[str] = {"X", "Y", "D", "M"}
-_DEV_SPLIT_PATTERN = re.compile(r"([XYDM])(\d+)", re.IGNORECASE)
 
 # ──────────────────── 共通ユーティリティ ────────────────────
 def _build_context(max_tokens: int = 200_000) -> str:
@@ -40,7 +40,7 @@ def _build_context(max_tokens: int = 200_000) -> str:
     コメント & PLC プログラムを大きな一塊のテキストにして返す。
     * token 数オーバーを避けるため、長過ぎる場合は末尾を切り捨てる
     * コメントは「デバイス: コメント」の1行形式
-    * プログラムは I/O(デバイス) 列だけを抽出
+    * プログラムは I/O(デバイス) 列だけを抽出 (重複は初出順で 1 回のみ)
     """
     lines: list[str] = []
 
@@ -49,17 +49,14 @@ def _build_context(max_tokens: int = 200_000) -> str:
         lines.append(f"{dev}: {comment}")
 
     # --- PLC プログラム (I/O(デバイス) 列のみ) ------------------------------
-    for prog in plc_agent.PROGRAMS.values():
-        headers = prog.get("headers", [])
-        rows = prog.get("rows", [])
-
-        if "I/O(デバイス)" not in headers:
-            continue
-
-        io_idx = headers.index("I/O(デバイス)")
-        for row in rows:
-            if len(row) > io_idx and row[io_idx].strip():
-                lines.append(row[io_idx].strip())
+    # (列抽出は file_io.load_program で済ませてある)
+    lines.extend(
+        dict.fromkeys(
+            chain.from_iterable(
+                prog["_io_col"] for prog in plc_agent.PROGRAMS.values()
+            )
+        )
+    )
 
     # --- トークン長をざっくり制御 (≈4 文字 ≒ 1 token として見積り) ----------
     joined = "\n".join(lines)
@@ -85,11 +82,10 @@ def _sanitize_device(parsed: dict[str, t.Any]) -> dict[str, t.Any]:
         parsed["dev"] = dev_raw
         return parsed
 
-    # 英字 + 数値 連結パターンを分離
-    match = _DEV_SPLIT_PATTERN.fullmatch(dev_raw)
-    if match:
-        parsed["dev"] = match.group(1).upper()
-        parsed["address"] = int(match.group(2))
+    # 英字 1 文字 + 数値 連結パターン (例: Y1000) を分離
+    if len(dev_raw) >= 2 and dev_raw[0] in ALLOWED_DEVS and dev_raw[1:].isdecimal():
+        parsed["dev"] = dev_raw[0]
+        parsed["address"] = int(dev_raw[1:])
         return parsed
 
     return {"error": "invalid dev"}
@@ -97,7 +93,7 @@ def _sanitize_device(parsed: dict[str, t.Any]) -> dict[str, t.Any]:
 
 # ──────────────────── OpenAI Tool 実装 ────────────────────
 @tool
-def reasoning_device(query: str) -> str:
+async def reasoning_device(query: str) -> str:
     """
     ユーザー質問 (`query`) から対象デバイスを推定して返す。
 
@@ -127,7 +123,7 @@ def reasoning_device(query: str) -> str:
         },
     ]
 
-    resp = client.chat.completions.create(
+    resp = await client.chat.completions.create(
         model="o4-mini",
         messages=messages,
     )
@@ -136,11 +132,11 @@ def reasoning_device(query: str) -> str:
 
     # フォーマット保証のため簡易検証し、失敗時はエラー文字列を返す
     try:
-        parsed: dict[str, t.Any] = json.loads(content)
+        parsed: dict[str, t.Any] = orjson.loads(content)
         if isinstance(parsed, dict) and "dev" in parsed and "address" in parsed:
             parsed = _sanitize_device(parsed)
-            return json.dumps(parsed, ensure_ascii=False)
-    except json.JSONDecodeError:
+            return orjson.dumps(parsed).decode()  # UTF-8 のまま (ensure_ascii 不要)
+    except orjson.JSONDecodeError:
         pass
 
     return '{"error": "unparsable"}'
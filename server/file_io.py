@@ -2,56 +2,199 @@
 file_io.py
 =================================
 ファイル I/O ユーティリティ
-・decode_bytes … CSV バイト列 → TextIO
-・load_program … 三菱 PLC CSV → dict 構造
+・decode_bytes   … CSV バイト列 → TextIO
+・detect_dialect … CSV 先頭サンプル → csv.Dialect (タブ / カンマ)
+・load_program   … 三菱 PLC CSV → dict 構造
 """
 
 from __future__ import annotations
+import codecs
 import csv
 import io
-from typing import Dict, List, TextIO
+import os
+import re
+import sys
+from itertools import islice
+from typing import Dict, List, Optional, TextIO, Tuple
 
-__all__ = ["decode_bytes", "load_program"]
+__all__ = ["decode_bytes", "detect_dialect", "load_program"]
 
+# 区切り文字判定で数えない引用符付きの値
+_QUOTED_RE = re.compile(r'"[^"]*"')
 
-def decode_bytes(data: bytes) -> io.StringIO:
+# 検索で使う列: 短縮キー → CSV ヘッダ名
+_SEARCH_COLUMNS: Dict[str, str] = {
+    "io": "I/O(デバイス)",
+    "step": "ステップ番号",
+    "inst": "命令",
+    "note": "ノート",
+}
+
+
+# 検証デコード 1 回あたりのバイト数
+_DECODE_CHUNK = 1 << 16
+
+
+def _can_decode(data: bytes, enc: str) -> bool:
+    """
+    data 全体が enc でデコード可能かをチャンク単位で確認する
+    (デコード結果の str は保持しないので、全体を一度に展開しない)
+    """
+    decoder = codecs.getincrementaldecoder(enc)()
+    view = memoryview(data)
+    try:
+        for pos in range(0, len(view), _DECODE_CHUNK):
+            decoder.decode(view[pos : pos + _DECODE_CHUNK])
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def decode_bytes(data: bytes) -> TextIO:
     """
     受け取ったバイト列をマルチエンコーディングでデコードして TextIO にする
-    優先順: UTF-8-SIG → UTF-16 → Shift-JIS → CP932 → UTF-8(replace)
+    BOM / ASCII 判定で候補を絞り、候補はチャンク単位の検証デコードで確定する
+    返り値は BytesIO を包んだ TextIOWrapper で、csv.reader が読む分だけ逐次デコードされる
+    (seek 可能なので load_program のサンプル読み → seek(0) もそのまま使える)
+    検証と本読みで 2 回デコードするが、StringIO は全文を UCS-4 バッファに持つため
+    数 MB の CP932 出力でもピークメモリが数十 MB 増える。時間よりピークを優先する
+    優先順: BOM (UTF-8-SIG / UTF-16) → ASCII → UTF-8 → Shift-JIS → CP932
+            → UTF-8(replace)
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        encodings: Tuple[str, ...] = ("utf-8-sig",)
+    elif data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        encodings = ("utf-16",)
+    elif data.isascii():
+        encodings = ("ascii",)
+    else:
+        encodings = ("utf-8", "shift_jis", "cp932")
+
+    for enc in encodings:
+        if enc == "ascii" or _can_decode(data, enc):
+            return io.TextIOWrapper(io.BytesIO(data), encoding=enc, newline="")
+    return io.TextIOWrapper(
+        io.BytesIO(data), encoding="utf-8", errors="replace", newline=""
+    )
+
+
+def detect_dialect(sample: str, header_row: int = 0) -> type[csv.Dialect]:
+    """
+    サンプル文字列から CSV Dialect を決める (load_program / load_comments 共通)
+    header_row 行目以降で、引用符付きの値を除いて最初に区切り文字が現れる行
+    (= ヘッダ行) だけでタブ数とカンマ数を比べる。タイトルだけの行や
+    コメント・ノート本文中のカンマは数えない
+    環境変数 CSV_SNIFF=1 の時のみ csv.Sniffer を使う
     """
-    for enc in ("utf-8-sig", "utf-16", "shift_jis", "cp932"):
+    if os.getenv("CSV_SNIFF") == "1":
+        # Sniffer は行末で切った短いサンプルだけに掛ける
+        nl = sample.rfind("\n")
+        if nl > 0:
+            sample = sample[: nl + 1]
         try:
-            return io.StringIO(data.decode(enc))
-        except UnicodeDecodeError:
-            continue
-    return io.StringIO(data.decode("utf-8", errors="replace"))
+            return csv.Sniffer().sniff(sample, delimiters=",\t")
+        except csv.Error:
+            return csv.excel_tab
+
+    for line in sample.splitlines()[header_row:]:
+        line = _QUOTED_RE.sub("", line)
+        tabs = line.count("\t")
+        commas = line.count(",")
+        if tabs or commas:
+            return csv.excel if commas > tabs else csv.excel_tab
+    return csv.excel_tab
 
 
 def load_program(stream: TextIO) -> Dict:
     """
-    三菱 PLC CSV を読み込み、基本メタ情報と本体行を dict で返す
-    { project, model, headers, rows }
+    三菱 PLC CSV を読み込み、基本メタ情報と検索用の列データを dict で返す
+    { project, model, headers, _io_col, io_index, columns }
+    _io_col    は I/O(デバイス) 列を正規化 (空白・引用符除去) した非空値を事前抽出したもの
+    io_index   は 正規化済み I/O(デバイス) 値 (空欄は除く) → 本体の行番号リスト の逆引き索引
+    columns    は検索で使う列 (io / step / inst / note) だけを列単位で持つ (短縮キー → 値リスト)
+               I/O(デバイス) 列が無い (短い) 行は None、他の列は "" で埋める
+    本体行そのもの (list[list[str]]) は保持しない
+    区切り文字は detect_dialect で判定 (CSV_SNIFF=1 で csv.Sniffer を使用)
+    空ファイルや I/O(デバイス) 列の無いファイルでも上記キーは全て揃えて返す
     """
-    sample: str = stream.read(1024)
+    sample: str = stream.read(512)
     stream.seek(0)
 
-    try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=",\t")
-    except csv.Error:
-        dialect = csv.excel_tab
+    # 1 行目はプロジェクト名、2 行目は機種 (区切りがヘッダと異なる出力もある)
+    reader = csv.reader(stream, detect_dialect(sample, 2))
+    head: List[List[str]] = list(islice(reader, 3))
+    if not head:
+        return _program_dict("", "", [])
+
+    project = head[0][0].strip().strip('"') if head[0] else ""
+    model = head[1][1].strip().strip('"') if len(head) > 1 and len(head[1]) > 1 else ""
+    headers = head[2] if len(head) > 2 else []
+
+    # ヘッダ名 → 列番号 (重複時は先頭優先で list.index と同じ, 読込中のみ使用)
+    header_idx: Dict[str, int] = {}
+    for i, h in enumerate(headers):
+        header_idx.setdefault(h, i)
+
+    # 検索対象列の列番号 (短縮キー → 列番号)
+    col_idx: Dict[str, int] = {
+        key: header_idx[name]
+        for key, name in _SEARCH_COLUMNS.items()
+        if name in header_idx
+    }
+
+    io_idx = col_idx.get("io")
+    if io_idx is None:
+        return _program_dict(project, model, headers)
 
-    rows: List[List[str]] = list(csv.reader(stream, dialect))
-    if not rows:
-        return {}
+    # 本体行は 1 パスで読み込み、必要な列の抽出と I/O(デバイス) 列の索引化だけを行う
+    io_col: List[str] = []
+    io_index: Dict[str, List[int]] = {}
 
-    project = rows[0][0].strip().strip('"') if rows[0] else ""
-    model = rows[1][1].strip().strip('"') if len(rows) > 1 and len(rows[1]) > 1 else ""
-    headers = rows[2] if len(rows) > 2 else []
-    body = rows[3:] if len(rows) > 3 else []
+    io_values: List[Optional[str]] = []
+    columns: Dict[str, list] = {"io": io_values}
+    extra: List[Tuple[int, List[str]]] = []
+    for key in ("step", "inst", "note"):
+        if key in col_idx:
+            columns[key] = []
+            extra.append((col_idx[key], columns[key]))
 
+    for i, row in enumerate(reader):
+        n = len(row)
+        for idx, col in extra:
+            col.append(row[idx] if n > idx else "")
+
+        if n > io_idx:
+            io_values.append(row[io_idx])
+            # 同じデバイスは多数の行で現れるため intern して 1 オブジェクトを共有
+            norm = sys.intern(row[io_idx].strip().strip('"'))
+            if norm:
+                io_col.append(norm)
+                io_index.setdefault(norm, []).append(i)
+        else:
+            io_values.append(None)
+
+    result = _program_dict(project, model, headers)
+    result["_io_col"] = tuple(io_col)
+    result["io_index"] = io_index
+    result["columns"] = columns
+    return result
+
+
+def _program_dict(
+    project: str,
+    model: str,
+    headers: List[str],
+) -> Dict:
+    """
+    load_program の返す dict の雛形 (I/O 関連キーは空で埋めておく)
+    検索側が prog["..."] で直接参照できるよう、常に全キーを揃える
+    """
     return {
         "project": project,
         "model": model,
         "headers": headers,
-        "rows": body,
+        "_io_col": (),
+        "io_index": {},
+        "columns": {},
     }
@@ -2,15 +2,34 @@
 gateway_client.py
 =================================
 Gateway (REST) との通信ヘルパ
-・read_device_values … デバイス値を取得
+・read_device_values_async … デバイス値を取得 (asyncio)
+・read_device_values_many  … 複数アドレスを連続区間ごとにまとめて取得 (asyncio)
 """
 
 from __future__ import annotations
-from typing import List
-import requests
+import asyncio
+from typing import Dict, Iterable, List, Tuple
+import httpx
+import orjson
 
+# Gateway の一時的な不調として再試行するステータス (読取は冪等な GET のみ)
+_RETRY_STATUS = frozenset({502, 503, 504})
+_RETRIES = 2          # 初回に加えて再試行する回数
+_RETRY_BACKOFF = 0.2  # 再試行待ち秒数の基数 (0.2, 0.4, ...)
 
-def read_device_values(
+# async 呼び出し用の共有クライアント (plc_agent の常駐ループ上で使い回す)
+# 接続失敗は transport 側で、502/503/504 は read_device_values_async で再試行する
+# (transport を渡すと Client 側の limits は無視されるので transport に持たせる)
+_ASYNC_HTTP = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        retries=_RETRIES,
+        limits=httpx.Limits(max_connections=32),
+    ),
+    timeout=httpx.Timeout(10.0, connect=3.0),
+)
+
+
+async def read_device_values_async(
     device: str,
     addr: int,
     length: int,
@@ -20,13 +39,54 @@ def read_device_values(
     port: str,
 ) -> List[int]:
     """
-    FastAPI Gateway からデバイス値を取得して list[int] で返す
+    FastAPI Gateway からデバイス値を取得して list[int] で返す (Agent の async tool から使用)
+    コネクションは共有クライアントでプールするため、単一のイベントループから呼ぶこと
+    502/503/504 は _RETRIES 回まで間隔を空けて再試行する
     """
     length = max(length, 1)
-    res = requests.get(
-        f"{base_url}/{device}/{addr}/{length}",
-        params={"ip": ip, "port": port},
-        timeout=30,
-    )
+    for attempt in range(_RETRIES + 1):
+        res = await _ASYNC_HTTP.get(
+            f"{base_url}/{device}/{addr}/{length}",
+            params={"ip": ip, "port": port},
+        )
+        if res.status_code not in _RETRY_STATUS or attempt == _RETRIES:
+            break
+        await asyncio.sleep(_RETRY_BACKOFF * 2 ** attempt)
     res.raise_for_status()
-    return res.json()["values"]
+    return orjson.loads(res.content)["values"]
+
+
+def _contiguous_ranges(addrs: Iterable[int]) -> List[Tuple[int, int]]:
+    """アドレス集合を (start, length) の連続区間リストにまとめる"""
+    ranges: List[Tuple[int, int]] = []
+    for a in sorted(set(addrs)):
+        if ranges and ranges[-1][0] + ranges[-1][1] == a:
+            start, length = ranges[-1]
+            ranges[-1] = (start, length + 1)
+        else:
+            ranges.append((a, 1))
+    return ranges
+
+
+async def read_device_values_many(
+    device: str,
+    addrs: Iterable[int],
+    *,
+    base_url: str,
+    ip: str,
+    port: str,
+) -> Dict[int, int]:
+    """
+    複数アドレスの値を {addr: value} で返す
+    連続するアドレスは 1 リクエストにまとめる
+    Gateway はリクエスト毎に PLC へ MC プロトコル接続を張るため、
+    同じポートへ同時接続しないよう区間同士は順番に取得する
+    """
+    values: Dict[int, int] = {}
+    for start, length in _contiguous_ranges(addrs):
+        vals = await read_device_values_async(
+            device, start, length, base_url=base_url, ip=ip, port=port
+        )
+        for i, v in enumerate(vals):
+            values[start + i] = v
+    return values
@@ -10,19 +10,23 @@ plc_agent.py
 from __future__ import annotations
 import asyncio
 import os
-from typing import Any, Dict
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict
 
 import httpx
 import openai
+import orjson
 from dotenv import load_dotenv
-from eventlet import tpool
-from agents import Agent, Runner, function_tool as tool
-from agents.exceptions import MaxTurnsExceeded
+from eventlet import patcher, tpool
+from eventlet.semaphore import Semaphore
+from agents import Agent, RunContextWrapper, RunHooks, Runner, function_tool as tool
 
 # 分離したヘルパ
 from file_io import decode_bytes, load_program
-from program_search import search_program, related_devices
-from gateway_client import read_device_values
+from program_search import iter_search, related_devices
+from gateway_client import read_device_values_async, read_device_values_many
 import comments_search as hs
 import device_reasoner as dr  # reasoning_device を提供
 
@@ -36,94 +40,304 @@ client = openai.OpenAI(
 
 # ──────────────────── グローバル ------------------------------------------------
 PROGRAMS: Dict[str, dict] = {}
+# PROGRAMS を更新したら +1 する (検索結果キャッシュの無効化キー)
+PROGRAMS_VERSION: int = 0
+
+# 最後にロードした COMMENT_CSV の (path, mtime_ns, size)
+# /api/comments でアップロードした後は _UPLOADED_COMMENTS になる
+_COMMENT_CACHE_KEY: tuple | None = None
+_UPLOADED_COMMENTS = ("<upload>",)
+
+# Agent 実行用の常駐 asyncio ループ
+# (eventlet にパッチされていない本物の OS スレッドで run_forever させる)
+_LOOP = asyncio.new_event_loop()
+patcher.original("threading").Thread(
+    target=_LOOP.run_forever, name="plc-agent-loop", daemon=True
+).start()
+
+READ_CACHE_TTL = 2.0  # read_values 結果の再利用秒数
+MAX_TURNS = 50        # 1 回の診断で許す Agent のターン数上限
 
 # ──────────────────── AI Diagnostics -----------------------------------------
-def _run_diagnostics(
-    *,
-    base_url: str,
-    ip: str,
-    port: str,
-    question: str,
+@dataclass
+class _RunCtx:
+    """
+    1 回の診断 (Runner.run) 単位の実行コンテキスト
+    Runner.run(context=...) で渡し、tool / hooks からは ctx.context で参照する
+    """
+
+    base_url: str
+    ip: str
+    port: str
+    # 実行内で共有する tool 結果キャッシュ
+    cache: Dict[tuple, Any] = field(default_factory=dict)
+
+
+# ---------- 検索ヘルパ (PROGRAMS_VERSION 単位でメモ化) ----------------------
+@lru_cache(maxsize=1024)
+def _search_cached(
+    dev: str, address: int, context: int, version: int
+) -> tuple[str, ...]:
+    return tuple("\n".join(b) for b in iter_search(PROGRAMS, dev, address, context))
+
+
+@lru_cache(maxsize=1024)
+def _related_cached(dev: str, address: int, version: int) -> str:
+    return ",".join(related_devices(PROGRAMS, dev, address))
+
+
+def _program_lines(dev: str, address: int) -> tuple[str, ...]:
+    return _search_cached(dev, address, 30, PROGRAMS_VERSION)
+
+
+def _related(dev: str, address: int) -> str:
+    return _related_cached(dev, address, PROGRAMS_VERSION)
+
+
+def _comment(dev: str, address: int) -> str:
+    return hs.get_comment(f"{dev}{address}")
+
+
+def _memo(
+    cache: Dict[tuple, Any], fn: Callable[[str, int], Any], dev: str, address: int
+) -> Any:
+    """実行単位キャッシュ経由で fn(dev, address) を返す"""
+    key = (fn.__name__, dev, address)
+    if key not in cache:
+        cache[key] = fn(dev, address)
+    return cache[key]
+
+
+# ---------- tool 群 (接続情報は実行コンテキストから取得) ----------------------
+@tool
+async def read_values(
+    ctx: RunContextWrapper[_RunCtx], dev: str, address: int, length: int
+) -> str:
+    """PLC デバイス値を取得する"""
+    dev = dev.upper()
+    length = length or 1
+
+    # ライブ値なので短い TTL でのみ再利用する
+    run = ctx.context
+    cache = run.cache
+    key = ("read_values", dev, address, length)
+    now = time.monotonic()
+    hit = cache.get(key)
+    if hit and now - hit[0] < READ_CACHE_TTL:
+        return hit[1]
+
+    vals = await read_device_values_async(
+        dev,
+        address,
+        length,
+        base_url=run.base_url,
+        ip=run.ip,
+        port=run.port,
+    )
+    text = ",".join(map(str, vals))
+    cache[key] = (now, text)
+    return text
+
+
+@tool
+async def read_values_many(
+    ctx: RunContextWrapper[_RunCtx], dev: str, addresses: list[int]
 ) -> str:
+    """複数アドレスの PLC デバイス値をまとめて取得する (例: Y10=1,Y11=0)"""
+    dev = dev.upper()
+    run = ctx.context
+    values = await read_device_values_many(
+        dev,
+        addresses,
+        base_url=run.base_url,
+        ip=run.ip,
+        port=run.port,
+    )
+    return ",".join(f"{dev}{a}={v}" for a, v in values.items())
+
+
+@tool
+async def program_lines(
+    ctx: RunContextWrapper[_RunCtx], dev: str, address: int
+) -> list[str]:
     """
-    OpenAI Agents で自律的に調査し『ANSWER: ...』を返す
+    周辺プログラム行を返す
     """
+    return list(_memo(ctx.context.cache, _program_lines, dev.upper(), address))
 
-    # ---------- tool 群 -----------------------------------------------------
-    @tool
-    def read_values(dev: str, address: int, length: int) -> str:
-        """PLC デバイス値を取得する"""
-        vals = read_device_values(
-            dev,
-            address,
-            length or 1,
-            base_url=base_url,
-            ip=ip,
-            port=port,
-        )
-        return ",".join(str(v) for v in vals)
-
-    @tool
-    def program_lines(dev: str, address: int) -> list[str]:
-        """
-        周辺プログラム行を返す
-        """
-        blocks = search_program(PROGRAMS, dev, address, context=30)
-        return ["\n".join(b) for b in blocks]
-
-    @tool
-    def related(dev: str, address: int) -> str:
-        """関連デバイス一覧"""
-        return ",".join(related_devices(PROGRAMS, dev, address))
-
-    @tool
-    def comment(dev: str, address: int) -> str:
-        """コメント取得"""
-        return hs.get_comment(f"{dev}{address}")
-
-    tools = [
-        dr.reasoning_device,  # ① デバイス推定
-        read_values,          # ② 読取
-        program_lines,        # ③ コード抜粋
-        related,              # ④ 関連デバイス
-        comment,              # ⑤ コメント
-    ]
-
-    agent = Agent(
+
+@tool
+async def related(ctx: RunContextWrapper[_RunCtx], dev: str, address: int) -> str:
+    """関連デバイス一覧"""
+    return _memo(ctx.context.cache, _related, dev.upper(), address)
+
+
+@tool
+async def comment(ctx: RunContextWrapper[_RunCtx], dev: str, address: int) -> str:
+    """コメント取得"""
+    return _memo(ctx.context.cache, _comment, dev.upper(), address)
+
+
+# ---------- 先行検索 (reasoning_device 直後) ---------------------------------
+_PREWARM_TASKS: set[asyncio.Task] = set()
+
+
+async def _prewarm(cache: Dict[tuple, Any], dev: str, address: int) -> None:
+    """program_lines / related の結果を実行単位キャッシュへ先に積んでおく"""
+    _memo(cache, _program_lines, dev, address)
+    await asyncio.sleep(0)
+    _memo(cache, _related, dev, address)
+
+
+class _PrewarmHooks(RunHooks):
+    """
+    reasoning_device が対象デバイスを返した時点で周辺検索をタスク化し、
+    次ターンの LLM 応答待ちの間に済ませておく
+    """
+
+    async def on_tool_end(self, context, agent, tool, result) -> None:
+        if tool.name != "reasoning_device":
+            return
+        try:
+            parsed = orjson.loads(result)
+            dev = str(parsed["dev"]).upper()
+            address = int(parsed["address"])
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+            return
+
+        task = asyncio.create_task(_prewarm(context.context.cache, dev, address))
+        _PREWARM_TASKS.add(task)
+        task.add_done_callback(_PREWARM_TASKS.discard)
+
+
+_HOOKS = _PrewarmHooks()
+
+
+# ---------- Agent (初回呼び出し時に 1 度だけ構築し使い回す) ------------------
+@lru_cache(maxsize=1)
+def _get_agent() -> Agent:
+    """
+    接続情報は実行コンテキスト (_RunCtx) 経由なので Agent 自体は全リクエストで共有できる
+    (device_reasoner との循環 import を避けるため遅延構築)
+    """
+    return Agent(
         name="PLC-Diagnostics",
         instructions=(
             "まず reasoning_device を呼び出して対象デバイスを JSON で取得し、\n"
             "続けて read_values / program_lines などを用いて推論し、\n"
+            "複数デバイスの値を読む場合は read_values_many でまとめて取得してください。\n"
             "最後に『ANSWER: ...』で日本語の結論だけを出力してください。\n"
             "推論のなかで追加で調査するデバイスはコメントを取得してから調査してください。\n"
             "不具合調査の場合は、原因は1つとは限らないので、\n"
             "複数の可能性を挙げて調査してください。\n"
         ),
         model="gpt-4.1-mini",
-        tools=tools,
+        tools=[
+            dr.reasoning_device,  # ① デバイス推定
+            read_values,          # ② 読取
+            read_values_many,     # ②' 一括読取
+            program_lines,        # ③ コード抜粋
+            related,              # ④ 関連デバイス
+            comment,              # ⑤ コメント
+        ],
         output_type=str,
     )
 
-    # eventlet 親和性のためスレッドプール実行
-    def _run(a: Agent, q: str, turns: int) -> Any:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            return Runner.run_sync(a, input=q, max_turns=turns)
-        finally:
-            asyncio.set_event_loop(None)
-            loop.close()
 
+async def _diagnose(
+    question: str,
+    turns: int,
+    base_url: str,
+    ip: str,
+    port: str,
+) -> Any:
+    """接続情報とキャッシュを _RunCtx にまとめ、Runner.run の context として渡す"""
+    return await Runner.run(
+        _get_agent(),
+        input=question,
+        context=_RunCtx(base_url=base_url, ip=ip, port=port),
+        max_turns=turns,
+        hooks=_HOOKS,
+    )
+
+
+# 同時に走らせる診断数の上限 (超過分は greenlet 側で順番待ち)
+_DIAG_SLOTS = Semaphore(int(os.getenv("DIAG_POOL_SIZE", "8")))
+
+
+# ループスレッド → 待ち受けスレッドの受け渡しに使う、パッチ前の本物の Queue
+# (monkey_patch 後の concurrent.futures.Future は green な Condition で待つため、
+#  OS スレッド間で共有すると完了通知が届かずに固まる)
+_ThreadQueue = patcher.original("queue").Queue
+
+
+# 常駐ループへ投入し、完了待ちだけを tpool に逃がす (eventlet ハブを塞がない)
+def _run(q: str, turns: int, base_url: str, ip: str, port: str) -> Any:
+    done: Any = _ThreadQueue(maxsize=1)
+
+    def _start() -> None:
+        task = _LOOP.create_task(_diagnose(q, turns, base_url, ip, port))
+        task.add_done_callback(done.put)
+
+    _LOOP.call_soon_threadsafe(_start)
+    # 完了した Task を受け取り、結果 (または例外) を呼び出し側で取り出す
+    return tpool.execute(done.get).result()
+
+
+def _run_diagnostics(
+    *,
+    base_url: str,
+    ip: str,
+    port: str,
+    question: str,
+) -> str:
+    """
+    OpenAI Agents で自律的に調査し『ANSWER: ...』を返す
+    """
+    # 30 ターンで打ち切って最初からやり直すと前半の実行が無駄になるため、
+    # 最初から上限 MAX_TURNS で 1 回だけ実行する
     try:
-        result = tpool.execute(_run, agent, question, 30)
-        return result.final_output
-    except MaxTurnsExceeded:
-        result = tpool.execute(_run, agent, question, 50)
+        with _DIAG_SLOTS:
+            result = _run(question, MAX_TURNS, base_url, ip, port)
         return result.final_output
     except Exception as ex:
         return f"AI 呼び出しでエラーが発生しました: {ex}"
 
 # ──────────────────── 公開 API -------------------------------------------------
+def load_comment_csv(path: str | None) -> None:
+    """
+    コメント CSV をロードする (前回ロード時から未変更なら何もしない)
+    変更判定は (path, mtime, size)
+    コメントがアップロード済み (load_comment_upload) の場合はアップロード側を優先し、
+    プロセス再起動まで COMMENT_CSV は読まない
+    """
+    global _COMMENT_CACHE_KEY
+    if _COMMENT_CACHE_KEY is _UPLOADED_COMMENTS:
+        return
+    if not path or not os.path.exists(path):
+        return
+
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key == _COMMENT_CACHE_KEY:
+        return
+
+    with open(path, "rb") as f:
+        hs.load_comments(decode_bytes(f.read()))
+    _COMMENT_CACHE_KEY = key
+
+
+def load_comment_upload(data: bytes) -> int:
+    """
+    アップロードされたコメント CSV をロードし、件数を返す
+    以降の質問では COMMENT_CSV の変更を見ず、このコメントを使い続ける
+    """
+    global _COMMENT_CACHE_KEY
+    hs.load_comments(decode_bytes(data))
+    _COMMENT_CACHE_KEY = _UPLOADED_COMMENTS
+    return len(hs.COMMENTS)
+
+
 def run_analysis(
     question: str,
     *,
@@ -134,11 +348,8 @@ def run_analysis(
     """
     Flask から直接呼び出すエントリポイント
     """
-    # コメントは毎回ロード
-    comment_path = os.getenv("COMMENT_CSV")
-    if comment_path and os.path.exists(comment_path):
-        with open(comment_path, "rb") as f:
-            hs.load_comments(decode_bytes(f.read()))
+    # コメントはファイル更新時のみ再ロード
+    load_comment_csv(os.getenv("COMMENT_CSV"))
 
     if not hs.COMMENTS:
         return "コメントがロードされていません"
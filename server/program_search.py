@@ -2,13 +2,94 @@
 program_search.py
 =================================
 PLC プログラム検索ユーティリティ
-・search_program … 対象デバイス出現ブロック抽出
+・iter_search     … 対象デバイス出現ブロックを逐次生成
+・search_program … 対象デバイス出現ブロック抽出 (list 版)
 ・related_devices … 近傍で使用される他デバイス一覧
 """
 
 from __future__ import annotations
 import re
-from typing import Dict, List
+import sys
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# 関連デバイス抽出用 (related_devices の呼び出し毎に compile しない)
+_DEV_RE = re.compile(r"[XYMDTS]\d+")
+
+
+def _iter_hits(
+    programs: Dict[str, dict],
+    target: str,
+) -> Iterator[Tuple[Dict[str, list], List[int]]]:
+    """
+    target を含むプログラムごとに (columns, 出現行番号リスト) を yield
+    出現行は load_program で作った索引から引き (全行走査しない)、
+    target を含まないプログラムは dict 参照 1 回で読み飛ばす
+    """
+    for prog in programs.values():
+        hits = prog["io_index"].get(target)
+        if hits:
+            yield prog["columns"], hits
+
+
+def _format_rows(columns: Dict[str, list], rows: Iterable[int]) -> List[str]:
+    """
+    columns (load_program の列単位データ) の指定行を
+    『ステップN 命令 デバイス (ノート)』形式の文字列リストにする
+    """
+    # ループ内の参照はローカル変数に束縛
+    io_col = columns["io"]
+    step_col = columns.get("step")
+    inst_col = columns.get("inst")
+    note_col = columns.get("note")
+    join = " ".join
+
+    lines: List[str] = []
+    add = lines.append
+    for j in rows:
+        io_val = io_col[j]
+        if io_val is None:
+            continue
+
+        parts: List[str] = []
+
+        if step_col is not None and step_col[j]:
+            parts.append(f"ステップ{step_col[j]}")
+        if inst_col is not None and inst_col[j]:
+            parts.append(inst_col[j])
+        if io_val:
+            parts.append(io_val)
+        if note_col is not None and note_col[j]:
+            parts.append(f"({note_col[j]})")
+
+        if parts:
+            add(join(parts))
+
+    return lines
+
+
+def iter_search(
+    programs: Dict[str, dict],
+    device: str,
+    addr: int,
+    context: int = 0,
+) -> Iterator[List[str]]:
+    """
+    与えられた programs 内から指定デバイスが出現するブロックを順に yield
+    (呼び出し側が 1 回走査するだけならリストを作らずに済む)
+
+    Yields
+    ------
+    List[str]
+        [行1, 行2, ...] 形式の 1 ブロック
+    """
+    for columns, hits in _iter_hits(programs, sys.intern(f"{device}{addr}")):
+        n_rows = len(columns["io"])
+        for i in hits:
+            block = _format_rows(
+                columns, range(max(0, i - context), min(n_rows, i + context + 1))
+            )
+            if block:
+                yield block
 
 
 def search_program(
@@ -25,52 +106,28 @@ def search_program(
     List[List[str]]
         [[行1, 行2, ...], ...] 形式
     """
-    target: str = f"{device}{addr}"
-    blocks: List[List[str]] = []
-
-    for prog in programs.values():
-        headers = prog.get("headers", [])
-        rows = prog.get("rows", [])
-
-        if not rows or "I/O(デバイス)" not in headers:
-            continue
-
-        io_idx = headers.index("I/O(デバイス)")
-        step_idx = headers.index("ステップ番号") if "ステップ番号" in headers else None
-        inst_idx = headers.index("命令") if "命令" in headers else None
-        note_idx = headers.index("ノート") if "ノート" in headers else None
+    return list(iter_search(programs, device, addr, context))
 
-        for i, row in enumerate(rows):
-            if len(row) <= io_idx or row[io_idx].strip().strip('"') != target:
-                continue
 
-            start = max(0, i - context)
-            end = min(len(rows), i + context + 1)
-
-            block: List[str] = []
-            for j in range(start, end):
-                ctx = rows[j]
-                if len(ctx) <= io_idx:
-                    continue
-
-                parts: List[str] = []
-
-                if step_idx is not None and len(ctx) > step_idx and ctx[step_idx]:
-                    parts.append(f"ステップ{ctx[step_idx]}")
-                if inst_idx is not None and len(ctx) > inst_idx and ctx[inst_idx]:
-                    parts.append(ctx[inst_idx])
-                if len(ctx) > io_idx and ctx[io_idx]:
-                    parts.append(ctx[io_idx])
-                if note_idx is not None and len(ctx) > note_idx and ctx[note_idx]:
-                    parts.append(f"({ctx[note_idx]})")
-
-                if parts:
-                    block.append(" ".join(parts))
-
-            if block:
-                blocks.append(block)
-
-    return blocks
+def _iter_device_cells(
+    programs: Dict[str, dict],
+    target: str,
+    context: int,
+) -> Iterator[str]:
+    """
+    target 出現行の近傍 (±context 行) にある I/O(デバイス) 列の値を yield
+    重なり合う近傍ウィンドウの行も 1 度しか返さない (空セル・短い行は除く)
+    """
+    for columns, hits in _iter_hits(programs, target):
+        io_col = columns["io"]
+        n_rows = len(io_col)
+        rows: set[int] = set()
+        for i in hits:
+            rows.update(range(max(0, i - context), min(n_rows, i + context + 1)))
+        for j in rows:
+            cell = io_col[j]
+            if cell:
+                yield cell
 
 
 def related_devices(
@@ -82,13 +139,13 @@ def related_devices(
     """
     target ブロック近傍で使われている他デバイスを抽出してソート
     """
-    deps: set[str] = set()
-    pattern = re.compile(r"[XYMDTS]\d+")
-
-    for block in search_program(programs, device, addr, context):
-        for line in block:
-            for m in pattern.findall(line):
-                if m != f"{device}{addr}":
-                    deps.add(m)
+    target = sys.intern(f"{device}{addr}")
+
+    # 必要なのはデバイス名だけなので、行を整形せず I/O 列のセルだけを集め、
+    # 正規表現は連結バッファに対して 1 回だけ走らせる
+    deps: set[str] = set(
+        _DEV_RE.findall("\n".join(_iter_device_cells(programs, target, context)))
+    )
+    deps.discard(target)
 
     return sorted(deps)
@@ -0,0 +1,66 @@
+"""
+plc_agent の診断実行が eventlet.monkey_patch() 下でも完了することを確認する
+(app.py と同じく monkey_patch 後に plc_agent を import する)
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip("eventlet")
+pytest.importorskip("agents")
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# monkey_patch はプロセス全体に効くため、別プロセスで実行する
+_SCRIPT = textwrap.dedent(
+    """
+    import eventlet
+    eventlet.monkey_patch()
+
+    import asyncio
+    import types
+
+    import plc_agent as plc
+
+
+    async def _fake_run(agent, *, input, context, max_turns, hooks):
+        # LLM を呼ばずに、ループスレッド上で少し待ってから結果を返す
+        await asyncio.sleep(0.05)
+        return types.SimpleNamespace(final_output=f"ANSWER: {input} @ {context.ip}")
+
+
+    plc.Runner = types.SimpleNamespace(run=_fake_run)
+
+    def _ask(i):
+        return plc._run_diagnostics(
+            base_url="http://127.0.0.1:8001/api/read",
+            ip="127.0.0.1",
+            port="5511",
+            question=f"q{i}",
+        )
+
+    for answer in eventlet.GreenPool().imap(_ask, range(4)):
+        print(answer)
+    """
+)
+
+
+def test_run_diagnostics_completes_under_monkey_patch():
+    env = dict(os.environ, OPENAI_API_KEY="test", PYTHONPATH=SERVER_DIR)
+    proc = subprocess.run(
+        [sys.executable, "-c", _SCRIPT],
+        cwd=SERVER_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.splitlines() == [
+        f"ANSWER: q{i} @ 127.0.0.1" for i in range(4)
+    ]